@@ -1,10 +1,28 @@
 import os
+import sys
 import time
 import json
+import hmac
+import base64
+import hashlib
+import queue
+import atexit
+import logging
+import logging.handlers
 import requests
-import datetime
+import heapq
+import random
+import sqlite3
+import urllib.parse
 import krakenex
-from decimal import Decimal
+from decimal import Decimal, ROUND_DOWN
+from typing import NamedTuple
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # ========================
 # CONFIG
@@ -16,75 +34,419 @@ KRAKEN_FEE = 0.0052       # 0.52% per trade
 PROFIT_BUFFER = 0.0015    # 0.15% safety margin
 ROUND_TRIP_FEE = KRAKEN_FEE * 2
 SELL_THRESHOLD = ROUND_TRIP_FEE + PROFIT_BUFFER   # 0.67% net profit required
+SELL_THRESHOLD_PCT = SELL_THRESHOLD * 100
+NET_OF_FEE = 1 - Decimal(str(KRAKEN_FEE))        # share of a sale that reaches USD
 
 BASE_PAIRS = ["DOGE/USD", "SHIB/USD", "PEPE/USD", "FLOKI/USD", "BONK/USD"]
+POOL_SIZE = 4             # pairs kept in the trading pool after each scan
+
+LOOP_SECONDS = 15         # normal cycle
+FAST_LOOP_SECONDS = 5     # a position is close to the sell threshold
+IDLE_LOOP_SECONDS = 60    # nothing held / nothing moving
+NEAR_TRIGGER_PCT = 0.5    # "close" = within 0.5% of the sell threshold
+IDLE_MOVE_PCT = 1.0       # smoothed max |profit| below this counts as idle
+MOVE_EWMA = 0.2           # smoothing factor for the recent move estimate
+LOOP_JITTER = 2.0         # random extra sleep to de-correlate from rate windows
+
+STATE_DB = os.getenv("STATE_DB", "state.db")
+API_TIMEOUT = 10          # seconds before a silent connection counts as a failed attempt
+RETRY_TRIES = 5           # attempts per Kraken call
+RETRY_BASE = 0.5          # first backoff, doubled per attempt...
+RETRY_CAP = 4.0           # ...up to this many seconds
+RETRY_BUDGET = 10         # give up once a call has spent this long retrying
+TRANSIENT_ERRORS = frozenset({"EAPI:Rate limit exceeded", "EGeneral:Too many requests",
+                              "EService:Unavailable", "EService:Busy"})
+API_COUNTER_MAX = 15      # Kraken private-call counter ceiling (Starter tier)
+API_COUNTER_DECAY = 0.33  # counter points shed per second
+API_COSTS = {"AddOrder": 0, "CancelAll": 0, "ClosedOrders": 2, "Ledgers": 2,
+             "TradesHistory": 2}  # default 1
+# Market states that refuse our market orders; reduce_only still takes the closing sells
+NO_MARKET_ORDER_STATUSES = frozenset({"cancel_only", "post_only", "limit_only"})
+RESTRICTED_ERROR = "EAccount:Invalid permissions"  # with a "<X> trading restricted ..." detail
+RESTRICTED_TTL = 7 * 86400  # seconds a pair restriction is remembered; see README to clear early
+
+MARKETS = {}   # Kraken pair name (key/altname/wsname) -> AssetPairs info
+SCAN_PAIRS = {}           # BASE_PAIRS entry -> Kraken pair key, built with the snapshot
+ORDER_LIMITS = {}         # Kraken pair name -> (lot_step, min_volume), built with the snapshot
+
+# Cache lifetimes per data class, from fastest- to slowest-changing
+PRICE_TTL = 4             # seconds a ticker price is reused (below FAST_LOOP_SECONDS)
+BALANCE_TTL = 60          # seconds a Balance snapshot is reused between orders
+STATUS_TTL = 300          # snapshot age after which a blocking market status is re-checked
+SCAN_SECONDS = 600        # trading pool re-rank interval
+MARKETS_TTL = 86400       # AssetPairs metadata (lot size, ordermin) barely changes
+RECONCILE_CYCLES = 20     # loop cycles between USD ledger reconciliations
 
 # ========================
 # KRAKEN CLIENT
 # ========================
-kraken = krakenex.API(API_KEY, API_SECRET)
+class KrakenClient(krakenex.API):
+    """krakenex client that decodes response bodies with orjson when installed
+    and keys its request signer once instead of on every private call."""
+
+    _signer = None
+    _signer_secret = None
+    pinned_nonce = None   # replayed when resending an order whose first attempt may have landed
+
+    def _nonce(self):
+        return self.pinned_nonce or super()._nonce()
+
+    def _sign(self, data, urlpath):
+        if self._signer_secret != self.secret:
+            self._signer = hmac.new(base64.b64decode(self.secret), digestmod=hashlib.sha512)
+            self._signer_secret = self.secret
+        encoded = (str(data["nonce"]) + urllib.parse.urlencode(data)).encode()
+        signature = self._signer.copy()
+        signature.update(urlpath.encode() + hashlib.sha256(encoded).digest())
+        return base64.b64encode(signature.digest()).decode()
+
+    def _query(self, urlpath, data, headers=None, timeout=None):
+        url = self.uri + urlpath
+        # Same transport as krakenex 2.2.2: public endpoints only accept GET.
+        if "/public/" in urlpath:
+            self.response = self.session.get(url, params=data, headers=headers or {}, timeout=timeout)
+        else:
+            self.response = self.session.post(url, data=data, headers=headers or {}, timeout=timeout)
+        if self.response.status_code not in (200, 201, 202):
+            self.response.raise_for_status()
+        if self._json_options:
+            # Caller-set json_options() (e.g. parse_float) need the stdlib decoder.
+            return self.response.json(**self._json_options)
+        return json_loads(self.response.content)
+
+kraken = KrakenClient(API_KEY, API_SECRET)
+
+def error_code(err):
+    """Kraken errors read "<category>:<message>[:<detail>]"; keep the first two fields."""
+    return ":".join(err.split(":", 2)[:2])
+
+api_counter = {"level": 0.0, "at": float("-inf")}
+
+def throttle(method):
+    """Wait only as long as Kraken's decaying private-call counter needs to make room."""
+    cost = API_COSTS.get(method, 1)
+    now = time.monotonic()
+    level = max(0.0, api_counter["level"] - (now - api_counter["at"]) * API_COUNTER_DECAY)
+    if level + cost > API_COUNTER_MAX:
+        wait = (level + cost - API_COUNTER_MAX) / API_COUNTER_DECAY
+        time.sleep(wait)
+        now += wait
+        level = API_COUNTER_MAX - cost
+    api_counter.update(level=level + cost, at=now)
 
 def kraken_request(method, data=None, private=False):
-    """Wrapper for Kraken API requests with retries."""
-    for _ in range(3):
-        try:
-            if private:
-                return kraken.query_private(method, data or {})
-            else:
-                return kraken.query_public(method, data or {})
-        except Exception as e:
-            print(f"[ERROR] Kraken API call {method} failed: {e}")
-            time.sleep(2)
-    return None
+    """Wrapper for Kraken API requests with exponential backoff on transient failures.
+
+    An order resent after a dropped connection reuses its first nonce, so if
+    the first attempt did reach Kraken the resend is rejected, not filled twice.
+    Once that resend draws any error, or never gets through, retrying stops and
+    the result carries "unknown": True; the caller has to look the order up.
+    """
+    started = time.monotonic()
+    payload = dict(data or {})
+    errors = []
+    try:
+        for attempt in range(RETRY_TRIES):
+            try:
+                if private:
+                    throttle(method)
+                    res = kraken.query_private(method, payload, timeout=API_TIMEOUT)
+                else:
+                    res = kraken.query_public(method, payload, timeout=API_TIMEOUT)
+                errors = res.get("error") or []
+                if kraken.pinned_nonce and errors:
+                    # Invalid nonce only says the first attempt reached Kraken, not that
+                    # it was placed; Busy says nothing about it at all.
+                    return {"error": errors, "unknown": True}
+                if not any(error_code(err) in TRANSIENT_ERRORS for err in errors):
+                    return res
+                # Throttled or busy: Kraken rejected the call before acting on it.
+                log(f"[ERROR] Kraken API call {method} throttled: {errors}")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # Transport failures and undecodable bodies are retried; anything
+                # else (e.g. missing API keys) is a bug and should surface.
+                res = None
+                errors = [str(e)]
+                log(f"[ERROR] Kraken API call {method} failed: {e}")
+                if method == "AddOrder" and "nonce" in payload:
+                    kraken.pinned_nonce = payload["nonce"]
+            delay = min(RETRY_CAP, RETRY_BASE * 2 ** attempt) + random.uniform(0, 0.1)
+            if attempt == RETRY_TRIES - 1 or time.monotonic() - started + delay > RETRY_BUDGET:
+                break
+            time.sleep(delay)
+        if kraken.pinned_nonce:
+            return {"error": errors, "unknown": True}
+        return res
+    finally:
+        kraken.pinned_nonce = None
+
+# ========================
+# STATE (survives restarts)
+# ========================
+def open_state():
+    """Open the local sqlite snapshot so restarts don't re-probe restricted pairs."""
+    con = sqlite3.connect(STATE_DB, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("CREATE TABLE IF NOT EXISTS restricted (pair TEXT PRIMARY KEY, at REAL)")
+    if "at" not in {row[1] for row in con.execute("PRAGMA table_info(restricted)")}:
+        # Older rows have no timestamp (and may stem from key-wide errors); they expire on load.
+        con.execute("ALTER TABLE restricted ADD COLUMN at REAL")
+    return con
+
+state = open_state()
+restricted_pairs = set()
+
+def load_restricted():
+    """Forget restrictions older than RESTRICTED_TTL and load the rest."""
+    state.execute("DELETE FROM restricted WHERE at IS NULL OR at < ?", (time.time() - RESTRICTED_TTL,))
+    restricted_pairs.clear()
+    restricted_pairs.update(row[0] for row in state.execute("SELECT pair FROM restricted"))
+
+load_restricted()
+
+def pair_restricted(err):
+    """True only for errors naming the pair, e.g. "EAccount:Invalid permissions:SHIB trading
+    restricted for US:WA."; key-wide ones like EGeneral:Permission denied don't count."""
+    parts = err.split(":", 2)
+    return len(parts) == 3 and error_code(err) == RESTRICTED_ERROR and "restricted" in parts[2].lower()
+
+def mark_restricted(pair):
+    restricted_pairs.add(pair)
+    state.execute("INSERT OR REPLACE INTO restricted (pair, at) VALUES (?, ?)", (pair, time.time()))
 
 # ========================
 # UTILITIES
 # ========================
+def setup_logging():
+    """Queue log records so timestamping and stdout writes run on a background thread."""
+    formatter = logging.Formatter("[%(asctime)s.%(msecs)03d] %(message)s", "%Y-%m-%dT%H:%M:%S")
+    formatter.converter = time.gmtime
+    sink = logging.StreamHandler(sys.stdout)
+    sink.setFormatter(formatter)
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, sink)
+    listener.start()
+    atexit.register(listener.stop)
+
+    bot_logger = logging.getLogger("krakem")
+    bot_logger.setLevel(logging.INFO)
+    bot_logger.propagate = False
+    bot_logger.addHandler(logging.handlers.QueueHandler(records))
+    return bot_logger
+
+logger = setup_logging()
+
 def log(msg):
-    print(f"[{datetime.datetime.utcnow().isoformat()}] {msg}")
+    logger.info(msg)
+
+price_cache = {}          # pair -> (fetched_at, price)
 
 def get_price(pair):
+    """Last trade price; reused for PRICE_TTL so txids sharing a pair cost one call."""
+    hit = price_cache.get(pair)
+    if hit and time.monotonic() - hit[0] < PRICE_TTL:
+        return hit[1]
     res = kraken_request("Ticker", {"pair": pair})
     if not res or "error" in res and res["error"]:
         return None
-    return Decimal(res["result"][list(res["result"].keys())[0]]["c"][0])
+    price = Decimal(next(iter(res["result"].values()))["c"][0])
+    price_cache[pair] = (time.monotonic(), price)
+    return price
 
-def get_top_gainers():
-    """Fetch top gainers from Kraken (mock fallback if no endpoint)."""
-    try:
-        # Replace with Kraken endpoint once available; using fallback for now
-        # Example: Kraken doesn't provide direct "top gainers", so we'd need to simulate
-        res = kraken_request("Assets")
-        if not res:
-            raise Exception("No response")
-        # TODO: Implement actual gainer calculation from OHLC if needed
-        return BASE_PAIRS  # fallback
-    except:
-        return BASE_PAIRS
+def get_prices(pairs):
+    """Last prices for several pairs; uncached pairs in the snapshot share one Ticker call."""
+    now = time.monotonic()
+    batch = {}
+    for pair in pairs:
+        hit = price_cache.get(pair)
+        if pair in MARKETS and not (hit and now - hit[0] < PRICE_TTL):
+            batch[pair] = MARKETS[pair]["key"]
+    if batch:
+        res = kraken_request("Ticker", {"pair": ",".join(batch.values())})
+        if res and not res.get("error"):
+            for pair, key in batch.items():
+                t = res["result"].get(key)
+                if t:
+                    price_cache[pair] = (now, Decimal(t["c"][0]))
+    # Anything not filled by the batch falls back to a single-pair lookup.
+    prices = {}
+    for pair in pairs:
+        price = get_price(pair)
+        if price:
+            prices[pair] = price
+    return prices
+
+markets_cache = {"at": float("-inf")}
+
+def load_markets():
+    """Snapshot Kraken's USD pairs once, indexed by pair key, altname and wsname."""
+    res = kraken_request("AssetPairs")
+    if not res or res.get("error"):
+        log(f"[MARKETS] AssetPairs unavailable: {res and res.get('error')}")
+        return
+    load_restricted()  # let expired restrictions lapse with each snapshot
+    MARKETS.clear()
+    ORDER_LIMITS.clear()
+    markets_cache["at"] = time.monotonic()
+    for key, info in res["result"].items():
+        if info.get("quote") != "ZUSD":
+            continue
+        info = dict(info, key=key)
+        limits = (Decimal(1).scaleb(-info.get("lot_decimals", 8)), Decimal(info.get("ordermin") or 0))
+        for name in (key, info.get("altname"), info.get("wsname")):
+            if name:
+                MARKETS[name] = info
+                ORDER_LIMITS[name] = limits
+    SCAN_PAIRS.clear()
+    SCAN_PAIRS.update((p, MARKETS[p]["key"]) for p in BASE_PAIRS
+                      if p in MARKETS and MARKETS[p].get("status", "online") == "online")
+    log(f"[MARKETS] Loaded {len({i['key'] for i in MARKETS.values()})} USD pairs")
+
+def get_top_gainers(limit=len(BASE_PAIRS)):
+    """Rank BASE_PAIRS by 24h USD volume x 24h range from one batched Ticker call.
+
+    Kraken doesn't provide direct "top gainers", so this is the proxy. Online
+    pairs without a usable ticker keep their BASE_PAIRS order at the end;
+    restricted pairs and pairs missing from SCAN_PAIRS are left out.
+    """
+    if time.monotonic() - markets_cache["at"] > MARKETS_TTL:
+        load_markets()
+    known = {p: key for p, key in SCAN_PAIRS.items() if key not in restricted_pairs}
+    if not known:
+        return BASE_PAIRS[:limit]  # fallback
+    res = kraken_request("Ticker", {"pair": ",".join(known.values())})
+    if not res or res.get("error"):
+        return BASE_PAIRS[:limit]  # fallback
+    scores = {}
+    now = time.monotonic()
+    for pair, key in known.items():
+        t = res["result"].get(key)
+        if not t or not Decimal(t["c"][0]):
+            continue
+        price_cache[key] = (now, Decimal(t["c"][0]))  # reused when valuing positions this cycle
+        usd_volume = Decimal(t["v"][1]) * Decimal(t["p"][1])
+        scores[pair] = usd_volume * (Decimal(t["h"][1]) - Decimal(t["l"][1])) / Decimal(t["c"][0])
+    ranked = heapq.nlargest(limit, scores, key=scores.get)
+    unranked = [p for p in BASE_PAIRS if p in known and p not in scores]
+    return (ranked + unranked)[:limit]
+
+balance_cache = {"at": float("-inf"), "result": {}}
 
 def get_balance():
+    """Account balances, reused for BALANCE_TTL unless an order has filled since.
+
+    Returns None when Kraken can't be read, so callers keep what they had.
+    """
+    if time.monotonic() - balance_cache["at"] < BALANCE_TTL:
+        return balance_cache["result"]
     res = kraken_request("Balance", private=True)
     if not res or "result" not in res:
-        return {}
+        return None
+    balance_cache.update(at=time.monotonic(), result=res["result"])
     return res["result"]
 
+class Position(NamedTuple):
+    pair: str
+    vol: Decimal
+    cost: Decimal
+
 def get_positions():
+    """Open positions as {txid: Position}, parsed once from Kraken's string fields."""
     res = kraken_request("OpenPositions", private=True)
     if not res or "result" not in res:
         return {}
-    return res["result"]
+    return {txid: Position(pos["pair"], Decimal(pos["vol"]), Decimal(pos["cost"]))
+            for txid, pos in res["result"].items()}
 
 def cancel_all_orders():
     kraken_request("CancelAll", private=True)
 
+def confirm_order(pair, userref, res):
+    """Settle an AddOrder whose outcome was lost by looking the order up by userref.
+
+    Returns a txid result if Kraken holds the order, an error result if it
+    doesn't, and the unknown-outcome result unchanged if the lookup fails.
+    """
+    for method, field in (("OpenOrders", "open"), ("ClosedOrders", "closed")):
+        found = kraken_request(method, {"userref": userref}, private=True)
+        if not found or found.get("error"):
+            log(f"[ORDER] {pair} outcome unknown, {method} lookup failed: {found and found.get('error')}")
+            return res
+        txids = [txid for txid, order in found["result"].get(field, {}).items()
+                 if order.get("status") in ("pending", "open") or Decimal(order.get("vol_exec") or 0) > 0]
+        if txids:
+            log(f"[ORDER] {pair} confirmed as {txids} after a lost reply")
+            return {"error": [], "result": {"txid": txids}}
+    log(f"[ORDER] {pair} was not placed: {res['error']}")
+    return {"error": res["error"]}
+
 def place_order(pair, side, volume):
+    """Send a market order; returns the lot-rounded volume placed, or None."""
+    if pair in restricted_pairs:
+        log(f"[SKIP ORDER] {pair} is restricted for this account")
+        return None
+    status = MARKETS.get(pair, {}).get("status", "online")
+    if status in NO_MARKET_ORDER_STATUSES and time.monotonic() - markets_cache["at"] > STATUS_TTL:
+        load_markets()  # maintenance windows are short; don't skip on a day-old status
+        status = MARKETS.get(pair, {}).get("status", "online")
+    if status in NO_MARKET_ORDER_STATUSES:
+        log(f"[SKIP ORDER] {pair} market is {status}")
+        return None
+    limits = ORDER_LIMITS.get(pair)
+    if limits:
+        lot_step, min_volume = limits
+        volume = volume.quantize(lot_step, rounding=ROUND_DOWN)
+        if volume < min_volume:
+            log(f"[SKIP ORDER] {pair} volume {volume} below minimum {min_volume}")
+            return None
+    userref = random.randrange(1, 2 ** 31)  # lets a lost AddOrder reply be looked up
     log(f"[ORDER] {side.upper()} {volume} {pair}")
-    return kraken_request("AddOrder", {
+    res = kraken_request("AddOrder", {
         "pair": pair,
         "type": side,
         "ordertype": "market",
-        "volume": str(volume)
+        "volume": str(volume),
+        "userref": userref
     }, private=True)
+    if res and res.get("unknown"):
+        res = confirm_order(pair, userref, res)
+    errors = res.get("error", []) if res else []
+    if res and (not errors or res.get("unknown")):
+        balance_cache["at"] = float("-inf")
+    if any(pair_restricted(err) for err in errors):
+        log(f"[RESTRICTED] {pair}: {errors}")
+        mark_restricted(pair)
+    return volume if res and not errors else None
+
+# ========================
+# SELL DECISIONS
+# ========================
+def evaluate_positions(positions):
+    """Price every open position once and decide in one pass which to sell.
+
+    Returns (pair, vol, value, profit_pct, sell) rows; positions without a
+    price are left out and restricted pairs are never marked for sale.
+    """
+    rows = []
+    prices = get_prices({pos.pair for pos in positions.values()})
+    for pos in positions.values():
+        price = prices.get(pos.pair)
+        if not price:
+            continue
+        value = pos.vol * price
+        profit_pct = (value - pos.cost) / pos.cost * 100
+        sell = pos.pair not in restricted_pairs and profit_pct > SELL_THRESHOLD_PCT
+        rows.append((pos.pair, pos.vol, value, profit_pct, sell))
+    return rows
+
+def merge_sells(rows):
+    """Sum (vol, value) per pair over rows marked for sale, so each pair is one order."""
+    merged = {}
+    for pair, vol, value, _, sell in rows:
+        if sell:
+            total_vol, total_value = merged.get(pair, (Decimal("0"), Decimal("0")))
+            merged[pair] = (total_vol + vol, total_value + value)
+    return merged
 
 # ========================
 # STARTUP FORCE-SELL
@@ -98,58 +460,72 @@ def force_sell_startup():
         log("[STARTUP] No open positions.")
         return
 
-    for txid, pos in positions.items():
-        pair = pos["pair"]
-        vol = Decimal(pos["vol"])
-        cost = Decimal(pos["cost"])
-        price = get_price(pair)
-        if not price:
-            continue
-        current_value = vol * price
-        profit_pct = (current_value - cost) / cost * 100
-
-        if profit_pct > SELL_THRESHOLD * 100:
-            log(f"[FORCE-SELL] {pair} profit {profit_pct:.2f}% > {SELL_THRESHOLD*100:.2f}%")
-            place_order(pair, "sell", vol)
+    rows = evaluate_positions(positions)
+    for pair, _, _, profit_pct, sell in rows:
+        if sell:
+            log(f"[FORCE-SELL] {pair} profit {profit_pct:.2f}% > {SELL_THRESHOLD_PCT:.2f}%")
         else:
             log(f"[KEEP] {pair} profit {profit_pct:.2f}% <= threshold")
+    for pair, (vol, _) in merge_sells(rows).items():
+        place_order(pair, "sell", vol)
 
 # ========================
 # MAIN LOOP
 # ========================
+def loop_delay(holding, recent_move, near_trigger):
+    """Tighten the cycle near a sell trigger, relax it when nothing is moving."""
+    if near_trigger:
+        return FAST_LOOP_SECONDS
+    if not holding or recent_move < IDLE_MOVE_PCT:
+        return IDLE_LOOP_SECONDS
+    return LOOP_SECONDS
+
 def run_bot():
     log("[BOT] Starting loop...")
-    last_scan = 0
+    last_scan = float("-inf")
     trading_pairs = BASE_PAIRS
+    recent_move = None        # seeded from the first cycle, so a restart isn't read as idle
+    usd_balance = Decimal("0")
+    cycle = 0
+    next_reconcile = 0
 
     while True:
-        now = time.time()
+        now = time.monotonic()
 
         # Rescan every 10 minutes
-        if now - last_scan > 600:
-            top = get_top_gainers()
-            trading_pairs = top[1:5] if len(top) > 1 else BASE_PAIRS
+        if now - last_scan > SCAN_SECONDS:
+            trading_pairs = get_top_gainers(POOL_SIZE) or BASE_PAIRS
             log(f"[SCAN] Trading pool updated: {trading_pairs}")
             last_scan = now
 
-        # Balances
-        balances = get_balance()
-        usd_balance = Decimal(balances.get("ZUSD", "0"))
+        # Balances: local ledger, reconciled with Kraken every few cycles;
+        # a failed read keeps the ledger and retries next cycle
+        if cycle >= next_reconcile:
+            balances = get_balance()
+            if balances is not None:
+                usd_balance = Decimal(balances.get("ZUSD", "0"))
+                next_reconcile = cycle + RECONCILE_CYCLES
+        cycle += 1
 
         # Positions
         positions = get_positions()
-        total_value = Decimal("0")
-        for txid, pos in positions.items():
-            pair = pos["pair"]
-            vol = Decimal(pos["vol"])
-            cost = Decimal(pos["cost"])
-            price = get_price(pair)
-            if price:
-                total_value += vol * price
-                profit_pct = (vol*price - cost) / cost * 100
-                if profit_pct > SELL_THRESHOLD * 100:
-                    log(f"[SELL] {pair} profit {profit_pct:.2f}% > {SELL_THRESHOLD*100:.2f}%")
-                    place_order(pair, "sell", vol)
+        rows = evaluate_positions(positions)
+        total_value = sum((value for _, _, value, _, _ in rows), Decimal("0"))
+        max_move = max((abs(float(profit_pct)) for _, _, _, profit_pct, _ in rows), default=0.0)
+        near_trigger = any(profit_pct > SELL_THRESHOLD_PCT - NEAR_TRIGGER_PCT
+                           for pair, _, _, profit_pct, sell in rows
+                           if not sell and pair not in restricted_pairs)
+        for pair, _, _, profit_pct, sell in rows:
+            if sell:
+                log(f"[SELL] {pair} profit {profit_pct:.2f}% > {SELL_THRESHOLD_PCT:.2f}%")
+        for pair, (vol, value) in merge_sells(rows).items():
+            filled_vol = place_order(pair, "sell", vol)
+            if filled_vol:
+                usd_balance += filled_vol * (value / vol) * NET_OF_FEE
+        if recent_move is None:
+            recent_move = max_move
+        else:
+            recent_move = MOVE_EWMA * max_move + (1 - MOVE_EWMA) * recent_move
 
         log(f"[POOL] USD ${usd_balance:.2f} | Positions est ${total_value:.2f}")
 
@@ -158,11 +534,13 @@ def run_bot():
         for pair in trading_pairs:
             log(f"[SKIP BUY] {pair} waiting for dip + momentum")
 
-        time.sleep(15)
+        delay = loop_delay(bool(positions), recent_move, near_trigger)
+        time.sleep(max(0, delay - (time.monotonic() - now) + random.uniform(0, LOOP_JITTER)))
 
 # ========================
 # ENTRY
 # ========================
 if __name__ == "__main__":
+    load_markets()
     force_sell_startup()
     run_bot()